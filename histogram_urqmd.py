@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+
+""" UrQMD Histogramming in Map/Reduce Style
+
+The `fill` command histograms a single input file (.f14 or .h5) and writes
+the raw (unnormalized) result to a partial file. The `merge` command combines
+any number of partial files and normalizes the sum only once at the end.
+The `run` command drives the same map/reduce path with a local process pool.
+"""
+
+import argparse
+import logging
+import multiprocessing
+import numpy as np
+import matplotlib.pyplot as plt
+
+from urqmd_dataset import UrQMDDataset, SPECIES
+
+
+BINS_RAPIDITY = np.linspace(-4.0, 4.0, num=81)
+BINS_MT = np.linspace(0.0, 4.0, num=81)
+
+# (name, species, quantity, weights, bins, rapidity cut)
+HISTOGRAMS = [
+    ('y_all', None, 'y', None, BINS_RAPIDITY, None),
+    ('y_pions', 'pions', 'y', None, BINS_RAPIDITY, None),
+    ('y_nucleons', 'nucleons', 'y', None, BINS_RAPIDITY, None),
+    ('y_kaons', 'kaons', 'y', None, BINS_RAPIDITY, None),
+    ('mT_nucleons', 'nucleons', 'mT', 'mT_weights', BINS_MT, 1.0),
+    ('mT_pions', 'pions', 'mT', 'mT_weights', BINS_MT, 1.0),
+    ('mT_kaons', 'kaons', 'mT', 'mT_weights', BINS_MT, 1.0),
+]
+
+
+def add_derived_columns(df):
+    df['y'] = .5 * np.log((df.p0 + df.pz)/(df.p0 - df.pz))
+    df['mT'] = np.sqrt(df.m**2 + df.px**2 + df.py**2)
+    df['mT_weights'] = 1./df.mT**2
+    return df
+
+
+class Partial_Histograms(object):
+    """
+    Raw bin counts, sum of weights and sum of squared weights
+    together with the number of events they were filled from.
+    Partials can be added up in any order and are normalized only
+    when calling normalized().
+    """
+
+    def __init__(self):
+        self.event_no = 0
+        self.bins = dict()
+        self.counts = dict()
+        self.sumw = dict()
+        self.sumw2 = dict()
+        for name, species, quantity, weights, bins, y_cut in HISTOGRAMS:
+            self.bins[name] = np.asarray(bins, dtype=np.float64)
+            self.counts[name] = np.zeros(len(bins) - 1, dtype=np.int64)
+            self.sumw[name] = np.zeros(len(bins) - 1, dtype=np.float64)
+            self.sumw2[name] = np.zeros(len(bins) - 1, dtype=np.float64)
+
+    def fill(self, df):
+        """ Fill the histograms with the particles in df (events are counted separately) """
+        df = add_derived_columns(df)
+        for name, species, quantity, weights, bins, y_cut in HISTOGRAMS:
+            sel = df
+            if species: sel = sel[sel.ityp.isin(SPECIES[species])]
+            if y_cut is not None: sel = sel[np.abs(sel.y) < y_cut]
+            w = sel[weights].values if weights else np.ones(len(sel))
+            counts, _ = np.histogram(sel[quantity].values, bins=self.bins[name])
+            sumw, _ = np.histogram(sel[quantity].values, bins=self.bins[name], weights=w)
+            sumw2, _ = np.histogram(sel[quantity].values, bins=self.bins[name], weights=w**2)
+            self.counts[name] += counts
+            self.sumw[name] += sumw
+            self.sumw2[name] += sumw2
+
+    def merge(self, other):
+        """ Add the content of another partial result to this one """
+        if sorted(self.bins) != sorted(other.bins):
+            raise ValueError('Cannot merge partials containing different histograms.')
+        for name in self.bins:
+            if not np.array_equal(self.bins[name], other.bins[name]):
+                raise ValueError('Cannot merge partials with different binning for {}.'.format(name))
+        for name in self.bins:
+            self.counts[name] += other.counts[name]
+            self.sumw[name] += other.sumw[name]
+            self.sumw2[name] += other.sumw2[name]
+        self.event_no += other.event_no
+        return self
+
+    def normalized(self, name):
+        """ Returns the histogram (and its errors) scaled by 1 / bin_width / event_no """
+        if not self.event_no:
+            raise ValueError('Cannot normalize histograms filled from zero events.')
+        bin_width = np.diff(self.bins[name])
+        hist = self.sumw[name] / bin_width / self.event_no
+        err = np.sqrt(self.sumw2[name]) / bin_width / self.event_no
+        return hist, err
+
+    def save(self, path):
+        content = dict(event_no=self.event_no)
+        for name in self.bins:
+            content[name + '__bins'] = self.bins[name]
+            content[name + '__counts'] = self.counts[name]
+            content[name + '__sumw'] = self.sumw[name]
+            content[name + '__sumw2'] = self.sumw2[name]
+        with open(path, 'wb') as f:
+            np.savez(f, **content)
+
+    fields = ('bins', 'counts', 'sumw', 'sumw2')
+
+    @classmethod
+    def load(cls, path):
+        partial = cls.__new__(cls)
+        partial.bins, partial.counts, partial.sumw, partial.sumw2 = dict(), dict(), dict(), dict()
+        with np.load(path) as content:
+            if 'event_no' not in content.files:
+                raise ValueError('{} is not a partial result (no event_no).'.format(path))
+            partial.event_no = int(content['event_no'])
+            for key in content.files:
+                if key == 'event_no': continue
+                name, _, field = key.rpartition('__')
+                if not name or field not in cls.fields:
+                    raise ValueError('{} is not a partial result (unexpected entry {}).'.format(path, key))
+                getattr(partial, field)[name] = content[key]
+        for name in partial.bins.keys() | partial.counts.keys() | partial.sumw.keys() | partial.sumw2.keys():
+            missing = [field for field in cls.fields if name not in getattr(partial, field)]
+            if missing:
+                raise ValueError('{} is incomplete: histogram {} lacks {}.'.format(path, name, ', '.join(missing)))
+        return partial
+
+
+def histogram_file(path, event_no=None, chunksize=100000):
+    """ The map step: histogram a single .f14 or .h5 file chunk by chunk """
+    partial = Partial_Histograms()
+    event_ids = set()
+    dataset = UrQMDDataset(path, chunksize=chunksize)
+    columns = ['p0', 'px', 'py', 'pz', 'm', 'ityp']
+    if 'event_id' in dataset.columns: columns.append('event_id')
+    for df in dataset.iter_chunks(columns):
+        if 'event_id' in df: event_ids.update(df['event_id'].unique())
+        partial.fill(df)
+    if event_no:
+        partial.event_no = event_no
+    elif event_ids:
+        partial.event_no = len(event_ids)
+    else:
+        raise ValueError('The event_id is not included in {}. You must thus specify the number of events.'.format(path))
+    logging.info('Histogrammed {} events from {}.'.format(partial.event_no, path))
+    return partial
+
+
+def merge_partials(partials):
+    """ The reduce step: sum up all partial results """
+    merged = Partial_Histograms()
+    for partial in partials:
+        merged.merge(partial)
+    return merged
+
+
+def _histogram_file_star(task):
+    return histogram_file(*task)
+
+
+def plot_histograms(hists):
+    fig, ax = plt.subplots(1,2, figsize=(10,4))
+
+    ### rapidity distribution
+    ax[0].set_title('Rapidity Distribution')
+    ax[0].set_xlabel('rapidity y / GeV')
+    ax[0].set_ylabel('dN/dy')
+    bins = hists.bins['y_all']
+    hist, _ = hists.normalized('y_all')
+    ax[0].bar(bins[:-1], hist, width=np.diff(bins), color='grey', label='all particles')
+    bottom = np.zeros(len(bins) - 1)
+    for name, color, label in [('y_pions', 'blue', 'pions'), ('y_nucleons', 'yellow', 'nucleons'), ('y_kaons', 'red', 'kaons')]:
+        hist, _ = hists.normalized(name)
+        ax[0].bar(bins[:-1], hist, width=np.diff(bins), color=color, label=label, bottom=bottom)
+        bottom += hist
+    ax[0].legend()
+
+    ### transverse mass distribution
+    ax[1].set_title('Transverse Mass Distribution')
+    ax[1].set_xlabel('mT / GeV')
+    ax[1].set_ylabel('1/mT^2 dN/dmT')
+    for name, color, label in [('mT_nucleons', 'yellow', 'nucleons'), ('mT_pions', 'blue', 'pions'), ('mT_kaons', 'red', 'kaons')]:
+        bins = hists.bins[name]
+        hist, _ = hists.normalized(name)
+        ax[1].bar(bins[:-1], hist, width=np.diff(bins), color=color, log=True, fill=True, label=label)
+    ax[1].legend()
+    return fig
+
+
+def finish(args, merged):
+    logging.info('Merged histograms of {} events in total.'.format(merged.event_no))
+    if args.out:
+        merged.save(args.out)
+    if args.plot:
+        plot_histograms(merged)
+        plt.show()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Histogram UrQMD events in map/reduce style.')
+    parser.add_argument('--verbosity', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO', help="How verbose should the output be")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    fill = subparsers.add_parser('fill', help='Histogram a single input file and write a partial result.')
+    fill.add_argument('input_file', metavar='INPUT_FILE', help="The .f14 or HDF5 (.h5) file containing the UrQMD events")
+    fill.add_argument('out', metavar='PARTIAL_FILE', help='The .npz file to store the partial result in')
+    fill.add_argument('--event-no', type=int, help='Total number of events (if the event_id is not included in the data)')
+    fill.add_argument('--chunksize', type=int, default=100000, help='The number of lines to read in one go.')
+
+    merge = subparsers.add_parser('merge', help='Merge partial results and normalize them.')
+    merge.add_argument('partial_files', metavar='PARTIAL_FILE', nargs='+', help='Partial results written by the fill command')
+    merge.add_argument('--out', metavar='MERGED_FILE', help='Store the merged (still unnormalized) result, usable as a partial again')
+    merge.add_argument('--plot', action='store_true', help='Plot the normalized histograms')
+
+    run = subparsers.add_parser('run', help='Fill and merge on this machine using a process pool.')
+    run.add_argument('input_files', metavar='INPUT_FILE', nargs='+', help="The .f14 or HDF5 (.h5) files containing the UrQMD events")
+    run.add_argument('--processes', type=int, default=multiprocessing.cpu_count(), help='The number of worker processes')
+    run.add_argument('--event-no', type=int, nargs='+', help='Number of events per input file, either one value for all files or one per file (if the event_id is not included in the data)')
+    run.add_argument('--chunksize', type=int, default=100000, help='The number of lines to read in one go.')
+    run.add_argument('--out', metavar='MERGED_FILE', help='Store the merged (still unnormalized) result, usable as a partial again')
+    run.add_argument('--plot', action='store_true', help='Plot the normalized histograms')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.verbosity, format='%(asctime)s.%(msecs)d %(levelname)s %(message)s', datefmt="%Y-%m-%d %H:%M:%S")
+
+    if args.command == 'fill':
+        histogram_file(args.input_file, args.event_no, args.chunksize).save(args.out)
+    elif args.command == 'merge':
+        finish(args, merge_partials(Partial_Histograms.load(path) for path in args.partial_files))
+    elif args.command == 'run':
+        event_nos = args.event_no or [None]
+        if len(event_nos) == 1:
+            event_nos = event_nos * len(args.input_files)
+        elif len(event_nos) != len(args.input_files):
+            parser.error('--event-no takes either a single value or one value per input file.')
+        pool = multiprocessing.Pool(args.processes)
+        tasks = [(path, event_no, args.chunksize) for path, event_no in zip(args.input_files, event_nos)]
+        partials = pool.imap_unordered(_histogram_file_star, tasks)
+        merged = merge_partials(partials)
+        pool.close()
+        pool.join()
+        finish(args, merged)
+
+if __name__ == "__main__":
+    main()
@@ -11,17 +11,195 @@ import warnings
 import multiprocessing
 import time
 import queue
+import io
+import itertools
+from collections import OrderedDict
+
+try:
+    from pandas.api.internals import create_dataframe_from_blocks
+except ImportError:
+    create_dataframe_from_blocks = None
 
 
 class F14_Reader(object):
 
-    def __init__(self, data_file, add_event_columns=False, renumber_event_ids=True):
+    names = ['r0', 'rx', 'ry', 'rz', 'p0', 'px', 'py', 'pz', 'm', 'ityp', '2i3', 'chg', 'lcl#', 'ncl', 'or']
+    dtypes = {
+        'r0': np.float32, 'rx': np.float32, 'ry': np.float32, 'rz': np.float32,
+        'p0': np.float32, 'px': np.float32, 'py': np.float32, 'pz': np.float32, 'm': np.float32,
+        'ityp': np.int16, '2i3': np.int8, 'chg': np.int8, 'lcl#': np.uint32, 'ncl': np.uint16, 'or': np.uint16,
+        'event_id': np.uint32, 'event_ip': np.float32,
+    }
+
+    def __init__(self, data_file, add_event_columns=False, renumber_event_ids=True, events=None, species=None, impact_parameter=None):
+        """
+        The selection applies to get_dataframe() and iter_typed_dataframes():
+        events: (first, stop) range of event ids to keep
+        species: list of ityp values to keep
+        impact_parameter: (b_min, b_max) range of impact parameters to keep
+        """
         self.data_file = data_file
         self.add_event_columns = add_event_columns
         self.renumber_event_ids = renumber_event_ids
+        self.events = events
+        self.species = species
+        self.impact_parameter = impact_parameter
+
+    def get_dataframe(self, chunksize=100000, columns=None):
+        """
+        Reads the whole file (or only the given columns) into a single DataFrame.
+        A quick counting pass sizes typed column arrays up front and each
+        chunk is parsed directly into its slice of them, so the peak memory
+        stays close to the size of the final table.
+        """
+        names = self._column_names(columns)
+        if not self.data_file.seekable():
+            # no counting pass possible (e.g. reading from a pipe)
+            dfs = list(self.iter_typed_dataframes(chunksize, columns))
+            if not dfs:
+                return pd.DataFrame({name: np.empty(0, dtype=self.dtypes[name]) for name in names}, columns=names)
+            return pd.concat(dfs, ignore_index=True)
+        total = self.count_particles()
+        # one 2D array per dtype, laid out like the blocks of a DataFrame, so that
+        # pandas can use the buffers as they are instead of consolidating (copying) them
+        blocks = OrderedDict()
+        for name in names:
+            blocks.setdefault(np.dtype(self.dtypes[name]), []).append(name)
+        arrays = dict()
+        block_values = []
+        for dtype, block_names in blocks.items():
+            values = np.empty((len(block_names), total), dtype=dtype)
+            block_values.append((values, np.array([names.index(name) for name in block_names])))
+            for i, name in enumerate(block_names):
+                arrays[name] = values[i]
+        start = 0
+        for chunk in self._iter_particle_chunks(chunksize):
+            n, values_by_name = self._chunk_columns(chunk, names)
+            stop = start + n
+            if stop > total:
+                raise ValueError('Found more particles in {} than counted.'.format(self.data_file.name))
+            for name, values in values_by_name.items():
+                arrays[name][start:stop] = values
+            start = stop
+        if start != total:
+            raise ValueError('Found {} particles in {} but counted {}.'.format(start, self.data_file.name, total))
+        logging.info('Read {} particles from {}.'.format(total, self.data_file.name))
+        if create_dataframe_from_blocks:
+            df = create_dataframe_from_blocks(block_values, index=pd.RangeIndex(total), columns=pd.Index(names))
+        else:
+            # older pandas offer no public way to pass the blocks (the check below reports the copy)
+            df = pd.DataFrame(arrays, columns=names, copy=False)
+        if total and names and not np.shares_memory(df[names[0]].values, arrays[names[0]]):
+            logging.warning('The DataFrame does not use the preallocated arrays but a copy of them.')
+        return df
+
+    def iter_typed_dataframes(self, chunksize=100000, columns=None):
+        """ Yields DataFrames of typed columns, one per chunk of particle lines """
+        names = self._column_names(columns)
+        for chunk in self._iter_particle_chunks(chunksize):
+            n, values_by_name = self._chunk_columns(chunk, names)
+            if n: yield pd.DataFrame(values_by_name, columns=names, copy=False)
+
+    def _column_names(self, columns=None):
+        names = list(self.names)
+        if self.add_event_columns: names += ['event_id', 'event_ip']
+        if columns is None: return names
+        unknown = [name for name in columns if name not in self.dtypes]
+        if unknown: raise KeyError('Unknown column(s): {}'.format(', '.join(unknown)))
+        duplicates = [name for name in OrderedDict.fromkeys(columns) if list(columns).count(name) > 1]
+        if duplicates: raise ValueError('Duplicate column(s): {}'.format(', '.join(duplicates)))
+        return list(columns)
+
+    def count_particles(self):
+        """ Counts the (selected) particle lines in the file (and rewinds it) """
+        self.data_file.seek(0)
+        if self.species is None:
+            total = sum(n for n, block, event_id, event_ip in self._iter_particle_blocks(skip=True))
+        else:
+            # only the ityp column needs to be parsed to apply the species mask
+            total = sum(self._chunk_columns(chunk, [])[0] for chunk in self._iter_particle_chunks(100000))
+        self.data_file.seek(0)
+        return total
+
+    def _iter_particle_blocks(self, skip=False):
+        """
+        Yields (particle number, particle lines, event_id, event_ip) for each block
+        of particle lines. Only the event headers are tokenised, the particle lines
+        are taken by the "<particle number> <time>" line preceding each block
+        (and not even kept if skip is set). The collision counter line that UrQMD
+        writes between that line and the particles is skipped, as are the blocks
+        of events outside the selected event and impact parameter ranges.
+        """
+        curr_event_id = 0
+        curr_impact = 0.0
+        header_line = None
+        lines = iter(self.data_file)
+        for line in lines:
+            parts = line.split()
+            if not len(parts): continue
+            if parts[0] == 'UQMD':
+                header_line = 0
+                if self.renumber_event_ids: curr_event_id += 1
+            if header_line is not None:
+                if header_line == 3: curr_impact = float(parts[1])
+                if header_line == 5 and not self.renumber_event_ids: curr_event_id = int(parts[1])
+                header_line = header_line + 1 if header_line < 5 else None
+            if len(parts) == 2 and parts[0].isdigit():
+                n = int(parts[0])
+                if not n: continue
+                first = next(lines, '')
+                if len(first.split()) == 15:
+                    block = itertools.chain([first], itertools.islice(lines, n - 1))
+                else:
+                    block = itertools.islice(lines, n)
+                selected = self._event_selected(curr_event_id, curr_impact)
+                if skip or not selected:
+                    for line in block: pass
+                if selected:
+                    yield n, None if skip else list(block), curr_event_id, curr_impact
+
+    def _iter_particle_chunks(self, chunksize):
+        """
+        Yields (particle lines, event ids, event impact parameters) in chunks
+        of whole blocks holding at least chunksize particles (except the last one)
+        """
+        lines, event_ids, event_ips, counts = [], [], [], []
+        for n, block, event_id, event_ip in self._iter_particle_blocks():
+            lines += block
+            event_ids.append(event_id)
+            event_ips.append(event_ip)
+            counts.append(len(block))
+            if len(lines) >= chunksize:
+                yield lines, np.repeat(event_ids, counts), np.repeat(event_ips, counts)
+                lines, event_ids, event_ips, counts = [], [], [], []
+        if lines: yield lines, np.repeat(event_ids, counts), np.repeat(event_ips, counts)
+
+    def _event_selected(self, event_id, event_ip):
+        if self.events is not None and not self.events[0] <= event_id < self.events[1]: return False
+        if self.impact_parameter is not None and not self.impact_parameter[0] <= event_ip < self.impact_parameter[1]: return False
+        return True
 
-    def get_dataframe(self):
-        return pd.concat(list(self.iter_dataframes()), ignore_index=True)
+    def _chunk_columns(self, chunk, names):
+        """
+        Parses a chunk of particle lines into typed column arrays,
+        returns the number of (selected) particles and the columns
+        """
+        lines, event_ids, event_ips = chunk
+        particle_names = [name for name in names if name in self.names]
+        parsed_names = particle_names + ['ityp'] if self.species is not None and 'ityp' not in particle_names else particle_names
+        columns = dict()
+        if parsed_names:
+            df = pd.read_csv(io.StringIO(''.join(lines)), sep=r'\s+', header=None,
+                             names=self.names, usecols=parsed_names,
+                             dtype={name: self.dtypes[name] for name in parsed_names})
+            for name in particle_names:
+                columns[name] = df[name].values
+        if 'event_id' in names: columns['event_id'] = event_ids.astype(self.dtypes['event_id'])
+        if 'event_ip' in names: columns['event_ip'] = event_ips.astype(self.dtypes['event_ip'])
+        if self.species is None:
+            return len(lines), columns
+        mask = np.isin(df['ityp'].values, self.species)
+        return int(mask.sum()), {name: values[mask] for name, values in columns.items()}
 
     def iter_dataframes(self, chunksize=100000):
         curr_event_id = 0
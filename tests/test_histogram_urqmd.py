@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from histogram_urqmd import Partial_Histograms, merge_partials
+
+
+def particles(n, seed):
+    rng = np.random.RandomState(seed)
+    pz = rng.uniform(-2., 2., n)
+    px, py = rng.normal(size=n), rng.normal(size=n)
+    m = np.full(n, .938)
+    p0 = np.sqrt(m**2 + px**2 + py**2 + pz**2)
+    ityp = rng.choice([1, 101, 106, -106], n)
+    return pd.DataFrame({'p0': p0, 'px': px, 'py': py, 'pz': pz, 'm': m, 'ityp': ityp})
+
+
+def filled(n, seed, event_no):
+    partial = Partial_Histograms()
+    partial.fill(particles(n, seed))
+    partial.event_no = event_no
+    return partial
+
+
+def test_merged_partials_match_single_fill(tmpdir):
+    first, second = filled(200, 1, 3), filled(300, 2, 4)
+    first.save(str(tmpdir.join('first.npz')))
+    second.save(str(tmpdir.join('second.npz')))
+    merged = merge_partials(Partial_Histograms.load(str(tmpdir.join(name))) for name in ('first.npz', 'second.npz'))
+
+    single = Partial_Histograms()
+    single.fill(pd.concat([particles(200, 1), particles(300, 2)], ignore_index=True))
+    single.event_no = 7
+
+    assert merged.event_no == 7
+    for name in single.bins:
+        np.testing.assert_array_equal(merged.counts[name], single.counts[name])
+        np.testing.assert_allclose(merged.normalized(name), single.normalized(name))
+
+
+def test_load_rejects_foreign_file(tmpdir):
+    path = str(tmpdir.join('foreign.npz'))
+    np.savez(path, event_no=1, y_all__other=np.zeros(3))
+    with pytest.raises(ValueError):
+        Partial_Histograms.load(path)
+
+
+def test_load_rejects_incomplete_file(tmpdir):
+    path = str(tmpdir.join('incomplete.npz'))
+    np.savez(path, event_no=1, y_all__bins=np.zeros(3), y_all__counts=np.zeros(2))
+    with pytest.raises(ValueError):
+        Partial_Histograms.load(path)
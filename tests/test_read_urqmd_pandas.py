@@ -0,0 +1,74 @@
+import io
+import os
+
+import numpy as np
+import pytest
+
+import read_urqmd
+from read_urqmd_pandas import F14_Reader
+
+F14_FILE = os.path.join(os.path.dirname(__file__), 'data', 'events.f14')
+IMPACT_PARAMETERS = {11: 2.31, 12: 5.87, 13: 9.02, 14: 12.5}
+
+
+def reference_events():
+    with open(F14_FILE) as f:
+        return list(read_urqmd.F14_Reader(f).get_events())
+
+
+def test_get_dataframe_matches_reference_reader():
+    events = reference_events()
+    with open(F14_FILE) as f:
+        df = F14_Reader(f, add_event_columns=True, renumber_event_ids=False).get_dataframe(chunksize=5)
+    assert len(df) == sum(len(event['particle_properties']) for event in events)
+    counts = df.groupby('event_id').size()
+    for event in events:
+        assert counts.get(event['id'], 0) == len(event['particle_properties'])
+        if event['particle_properties']:
+            np.testing.assert_allclose(df[df.event_id == event['id']].event_ip, IMPACT_PARAMETERS[event['id']], rtol=1e-6)
+            reference = np.array(event['particle_properties'], dtype=np.float64)
+            np.testing.assert_allclose(df[df.event_id == event['id']].px, reference[:, 5], rtol=1e-6)
+            np.testing.assert_array_equal(df[df.event_id == event['id']].ityp, reference[:, 9])
+
+
+def test_get_dataframe_renumbers_events():
+    with open(F14_FILE) as f:
+        df = F14_Reader(f, add_event_columns=True).get_dataframe()
+    assert sorted(df.event_id.unique()) == [1, 3, 4]
+
+
+def test_get_dataframe_uses_preallocated_dtypes():
+    with open(F14_FILE) as f:
+        df = F14_Reader(f, add_event_columns=True).get_dataframe(columns=['px', 'ityp', 'event_id'])
+    assert list(df.columns) == ['px', 'ityp', 'event_id']
+    assert [df[name].dtype for name in df.columns] == [np.float32, np.int16, np.uint32]
+
+
+def test_get_dataframe_rejects_duplicate_columns():
+    with open(F14_FILE) as f:
+        with pytest.raises(ValueError):
+            F14_Reader(f).get_dataframe(columns=['px', 'px'])
+
+
+class Pipe(io.StringIO):
+    def seekable(self):
+        return False
+
+
+def test_get_dataframe_from_pipe():
+    with open(F14_FILE) as f:
+        content = f.read()
+    df = F14_Reader(Pipe(content)).get_dataframe(columns=['px'])
+    assert len(df) == sum(len(event['particle_properties']) for event in reference_events())
+    empty = F14_Reader(Pipe('')).get_dataframe(columns=['px', 'ityp'])
+    assert len(empty) == 0 and list(empty.columns) == ['px', 'ityp']
+
+
+def test_get_dataframe_without_block_api(monkeypatch):
+    import read_urqmd_pandas
+    with open(F14_FILE) as f:
+        expected = F14_Reader(f, add_event_columns=True).get_dataframe()
+    monkeypatch.setattr(read_urqmd_pandas, 'create_dataframe_from_blocks', None)
+    with open(F14_FILE) as f:
+        df = F14_Reader(f, add_event_columns=True).get_dataframe()
+    assert df.equals(expected)
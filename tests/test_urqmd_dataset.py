@@ -0,0 +1,67 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from read_urqmd_pandas import F14_Reader
+from urqmd_dataset import UrQMDDataset
+
+F14_FILE = os.path.join(os.path.dirname(__file__), 'data', 'events.f14')
+
+
+def full_table():
+    with open(F14_FILE) as f:
+        return F14_Reader(f, add_event_columns=True).get_dataframe()
+
+
+@pytest.fixture
+def runs(tmpdir):
+    for name in ('run_1.f14', 'run_2.f14'):
+        shutil.copy(F14_FILE, str(tmpdir.join(name)))
+    return str(tmpdir)
+
+
+def test_list_key_loads_columns_in_one_pass(runs, monkeypatch):
+    ds = UrQMDDataset(runs)
+    loads = []
+    load_source_columns = ds._load_source_columns
+    monkeypatch.setattr(ds, '_load_source_columns', lambda source, columns: loads.append(columns) or load_source_columns(source, columns))
+    df = ds[['px', 'py', 'run']]
+    assert loads == [['px', 'py'], ['px', 'py']]
+    assert len(df) == 2 * len(full_table())
+    assert sorted(df['run'].unique()) == [0, 1]
+    ds['px']
+    assert len(loads) == 2
+
+
+def test_iter_events_tells_runs_apart(runs):
+    events = [(run, event_id, len(event)) for run, event_id, event in UrQMDDataset(runs, chunksize=5).iter_events(['px'])]
+    sizes = full_table().groupby('event_id').size()
+    expected = [(event_id, size) for event_id, size in sizes.items()]
+    assert events == [(run, event_id, size) for run in (0, 1) for event_id, size in expected]
+    assert all(type(event_id) is int for run, event_id, size in events)
+
+
+def test_selection_is_pushed_into_f14_parsing():
+    table = full_table()
+    ds = UrQMDDataset(F14_FILE).select(species='pions', impact_parameter=(0.0, 10.0))
+    expected = table[(table.ityp == 101) & (table.event_ip < 10.0)]
+    np.testing.assert_array_equal(ds['px'], expected.px)
+    assert sum(len(df) for df in ds.iter_chunks(['px'], chunksize=3)) == len(expected)
+
+
+def test_select_intersects_and_clears():
+    ds = UrQMDDataset(F14_FILE)
+    assert len(ds.select(species='pions').select(species='kaons')['px']) == 0
+    narrowed = ds.select(events=(1, 4)).select(events=(3, 10))
+    assert narrowed.events == (3, 4)
+    assert len(narrowed.clear_selection()['px']) == len(full_table())
+
+
+def test_iter_events_requires_event_id(tmpdir):
+    pytest.importorskip('tables')
+    path = str(tmpdir.join('no_events.h5'))
+    full_table().drop(columns=['event_id', 'event_ip']).to_hdf(path, key='particles', format='table', data_columns=True)
+    with pytest.raises(ValueError):
+        list(UrQMDDataset(path).iter_events())
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+
+""" Lazy Access to UrQMD Events
+
+A UrQMDDataset opens a raw .f14 file, a converted HDF5 store or a directory
+of runs. Columns are loaded when they are first accessed and kept in a cache
+with a memory budget (least recently used columns are evicted first).
+Selections by event range, species or impact parameter (centrality) are
+pushed down to the storage layer. The virtual column run holds the index
+of the source (in sources) each particle was read from, as event ids
+repeat between runs.
+"""
+
+import os
+import argparse
+import logging
+from collections import OrderedDict
+import pandas as pd
+import numpy as np
+
+from read_urqmd_pandas import F14_Reader
+
+
+SPECIES = {
+    'nucleons': [1],
+    'pions': [101],
+    'kaons': [106, -106],
+}
+
+F14_EXTENSIONS = ('.f14',)
+HDF_EXTENSIONS = ('.h5', '.hdf5')
+
+
+class UrQMDDataset(object):
+
+    def __init__(self, path, memory_budget=1024**3, events=None, species=None, impact_parameter=None, chunksize=100000):
+        """
+        path: .f14 file, HDF5 store or directory containing such files (one per run)
+        memory_budget: maximum size of the column cache in bytes (None for no limit)
+        events: (first, stop) range of event ids to select, evaluated per run
+        species: species name(s) from SPECIES or ityp value(s) to select
+        impact_parameter: (b_min, b_max) range in fm to select (centrality)
+        """
+        self.path = path
+        self.memory_budget = memory_budget
+        self.events = events
+        self.species = self._resolve_species(species)
+        self.impact_parameter = impact_parameter
+        self.chunksize = chunksize
+        self.sources = self._find_sources(path)
+        self._cache = OrderedDict()
+
+    def select(self, events=None, species=None, impact_parameter=None):
+        """
+        Returns a new dataset on the same files with the given selection combined
+        with the current one (ranges and species are intersected)
+        """
+        species = self._resolve_species(species)
+        if species is not None and self.species is not None:
+            species = [ityp for ityp in self.species if ityp in species]
+        return UrQMDDataset(self.path, memory_budget=self.memory_budget,
+                            events=self._intersect(self.events, events),
+                            species=species if species is not None else self.species,
+                            impact_parameter=self._intersect(self.impact_parameter, impact_parameter),
+                            chunksize=self.chunksize)
+
+    def clear_selection(self):
+        """ Returns a new dataset on the same files without any selection """
+        return UrQMDDataset(self.path, memory_budget=self.memory_budget, chunksize=self.chunksize)
+
+    @property
+    def columns(self):
+        """ The columns available in all sources """
+        columns = self._source_columns(self.sources[0])
+        for source in self.sources[1:]:
+            source_columns = self._source_columns(source)
+            columns = [column for column in columns if column in source_columns]
+        return columns + ['run']
+
+    @property
+    def cache_size(self):
+        return sum(values.nbytes for values in self._cache.values())
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return pd.Series(self._get_columns([key])[key], name=key)
+        key = list(key)
+        return pd.DataFrame(self._get_columns(key), columns=key)
+
+    def iter_chunks(self, columns=None, chunksize=None):
+        """ Yields DataFrames of the selected particles, chunk by chunk over all runs """
+        for run, source in enumerate(self.sources):
+            for df in self._iter_source_chunks(run, source, columns, chunksize or self.chunksize):
+                yield df
+
+    def iter_events(self, columns=None):
+        """ Yields (run, event_id, DataFrame) for each selected event """
+        if columns is not None and 'event_id' not in columns:
+            columns = list(columns) + ['event_id']
+        for source in self.sources:
+            if 'event_id' not in self._source_columns(source):
+                raise ValueError('{} has no event_id column (was it converted with --no-event-columns?).'.format(source))
+        for run, source in enumerate(self.sources):
+            rest = None
+            for df in self._iter_source_chunks(run, source, columns, self.chunksize):
+                if not len(df): continue
+                if rest is not None: df = pd.concat([rest, df], ignore_index=True)
+                # the last event may continue in the next chunk
+                last_id = df['event_id'].iat[-1]
+                rest = df[df['event_id'] == last_id]
+                for event_id, event in df[df['event_id'] != last_id].groupby('event_id', sort=False):
+                    yield run, int(event_id), event
+            if rest is not None and len(rest):
+                yield run, int(rest['event_id'].iat[0]), rest
+
+    def _get_columns(self, columns):
+        """ Returns the given columns, loading all uncached ones in a single pass """
+        missing = [column for column in OrderedDict.fromkeys(columns) if column not in self._cache]
+        values = self._load_columns(missing) if missing else dict()
+        for column in columns:
+            if column in missing:
+                self._cache[column] = values[column]
+            else:
+                self._cache.move_to_end(column)
+                values[column] = self._cache[column]
+        self._evict()
+        return values
+
+    def _evict(self):
+        if self.memory_budget is None: return
+        # always keep the most recently used column, even if it alone exceeds the budget
+        while len(self._cache) > 1 and self.cache_size > self.memory_budget:
+            column, values = self._cache.popitem(last=False)
+            logging.debug('Evicted column {} ({} bytes) from the cache.'.format(column, values.nbytes))
+
+    def _load_columns(self, columns):
+        stored = self._stored_columns(columns)
+        parts = []
+        for run, source in enumerate(self.sources):
+            part = self._load_source_columns(source, stored)
+            if 'run' in columns:
+                part['run'] = np.full(len(part[stored[0]]), run, dtype=np.uint16)
+            parts.append(part)
+        if len(parts) == 1: return {column: parts[0][column] for column in columns}
+        return {column: np.concatenate([part[column] for part in parts]) for column in columns}
+
+    def _load_source_columns(self, source, columns):
+        logging.info('Loading column(s) {} from {}.'.format(', '.join(columns), source))
+        if source.endswith(F14_EXTENSIONS):
+            with open(source, 'r', encoding='ascii') as data_file:
+                df = self._f14_reader(data_file).get_dataframe(chunksize=self.chunksize, columns=columns)
+        else:
+            with pd.HDFStore(source, 'r') as hdf:
+                df = hdf.select('particles', columns=columns, where=self._hdf_where(), stop=0 if self._selects_nothing() else None)
+        return {column: df[column].values for column in columns}
+
+    def _iter_source_chunks(self, run, source, columns, chunksize):
+        stored = None if columns is None else self._stored_columns(columns)
+        for df in self._iter_stored_chunks(source, stored, chunksize):
+            if columns is None or 'run' in columns:
+                df['run'] = np.uint16(run)
+            yield df if columns is None else df[list(columns)]
+
+    def _iter_stored_chunks(self, source, columns, chunksize):
+        if source.endswith(F14_EXTENSIONS):
+            with open(source, 'r', encoding='ascii') as data_file:
+                for df in self._f14_reader(data_file).iter_typed_dataframes(chunksize=chunksize, columns=columns):
+                    yield df
+        elif not self._selects_nothing():
+            with pd.HDFStore(source, 'r') as hdf:
+                for df in hdf.select('particles', columns=columns, where=self._hdf_where(), chunksize=chunksize):
+                    yield df
+
+    @staticmethod
+    def _stored_columns(columns):
+        """ The columns to read from the sources (ityp stands in to count the rows if only run is requested) """
+        return [column for column in columns if column != 'run'] or ['ityp']
+
+    @staticmethod
+    def _source_columns(source):
+        if source.endswith(F14_EXTENSIONS):
+            return list(F14_Reader.names) + ['event_id', 'event_ip']
+        with pd.HDFStore(source, 'r') as hdf:
+            return list(hdf.select('particles', start=0, stop=0).columns)
+
+    def _f14_reader(self, data_file):
+        return F14_Reader(data_file, add_event_columns=True, events=self.events,
+                          species=self.species, impact_parameter=self.impact_parameter)
+
+    def _hdf_where(self):
+        where = []
+        if self.events is not None:
+            where += ['event_id >= {}'.format(self.events[0]), 'event_id < {}'.format(self.events[1])]
+        if self.impact_parameter is not None:
+            where += ['event_ip >= {}'.format(self.impact_parameter[0]), 'event_ip < {}'.format(self.impact_parameter[1])]
+        if self.species is not None:
+            where += ['ityp = {}'.format(self.species)]
+        return where or None
+
+    def _selects_nothing(self):
+        if self.species is not None and not self.species: return True
+        for selected_range in (self.events, self.impact_parameter):
+            if selected_range is not None and selected_range[0] >= selected_range[1]: return True
+        return False
+
+    @staticmethod
+    def _intersect(first, second):
+        if first is None: return second
+        if second is None: return first
+        return (max(first[0], second[0]), min(first[1], second[1]))
+
+    @staticmethod
+    def _resolve_species(species):
+        if species is None: return None
+        if isinstance(species, (str, int)): species = [species]
+        ityps = []
+        for item in species:
+            ityps += SPECIES[item] if isinstance(item, str) else [int(item)]
+        return ityps
+
+    @staticmethod
+    def _find_sources(path):
+        if not os.path.isdir(path): return [path]
+        sources = sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(F14_EXTENSIONS + HDF_EXTENSIONS))
+        if not sources: raise ValueError('No .f14 or HDF5 files found in {}.'.format(path))
+        return sources
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show a quick summary of a UrQMD dataset.')
+    parser.add_argument('path', metavar='PATH', help="A .f14 file, an HDF5 (.h5) file or a directory of runs")
+    parser.add_argument('columns', metavar='COLUMN', nargs='*', default=['ityp'], help='The columns to describe')
+    parser.add_argument('--species', nargs='+', help='Species names ({}) or ityp values to select'.format(', '.join(sorted(SPECIES))))
+    parser.add_argument('--events', type=int, nargs=2, metavar=('FIRST', 'STOP'), help='Range of event ids to select')
+    parser.add_argument('--impact-parameter', type=float, nargs=2, metavar=('B_MIN', 'B_MAX'), help='Range of impact parameters (fm) to select')
+    parser.add_argument('--verbosity', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO', help="How verbose should the output be")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.verbosity, format='%(asctime)s.%(msecs)d %(levelname)s %(message)s', datefmt="%Y-%m-%d %H:%M:%S")
+
+    species = None
+    if args.species:
+        species = [int(item) if item.lstrip('-').isdigit() else item for item in args.species]
+    dataset = UrQMDDataset(args.path, events=args.events, species=species, impact_parameter=args.impact_parameter)
+    print(dataset[args.columns].describe())
+
+if __name__ == "__main__":
+    main()